@@ -0,0 +1,85 @@
+import os
+import json
+import logging
+from typing import Any
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+try:
+    import orjson
+except ImportError:  # orjson ships with fastapi[all]; fall back to the stdlib encoder without it
+    orjson = None
+
+logger = logging.getLogger("stockstalk.cache")
+
+# Optional shared cache: set REDIS_URL to share fetched data across workers and restarts.
+# Without it (or if Redis is unreachable) callers fall back to their in-process caches.
+# The client is created on first use so REDIS_URL from a .env loaded after import is honored.
+_redis_client = None
+_redis_configured = False
+
+def _get_client():
+    global _redis_client, _redis_configured
+    if not _redis_configured:
+        _redis_configured = True
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url and redis is not None:
+            _redis_client = redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            logger.info("Redis cache enabled")
+        elif redis_url:
+            logger.warning("REDIS_URL is set but the redis package is not installed - Redis cache disabled")
+    return _redis_client
+
+
+async def get_json(key: str) -> Any | None:
+    """Get a JSON value from Redis, or None on a miss or when Redis is unavailable"""
+    client = _get_client()
+    if client is None:
+        return None
+    try:
+        raw = await client.get(key)
+    except (redis.RedisError, OSError) as e:
+        logger.warning("Redis GET %s failed: %s", key, e)
+        return None
+    if raw is None:
+        return None
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+async def set_json(key: str, value: Any, ttl: int) -> None:
+    """Store a JSON value in Redis with a TTL in seconds; failures are logged and ignored"""
+    client = _get_client()
+    if client is None:
+        return
+    try:
+        payload = orjson.dumps(value, default=str) if orjson else json.dumps(value, default=str)
+        await client.setex(key, ttl, payload)
+    except (redis.RedisError, OSError) as e:
+        logger.warning("Redis SETEX %s failed: %s", key, e)
+
+
+async def delete(*keys: str) -> None:
+    """Remove keys from Redis; failures are logged and ignored"""
+    client = _get_client()
+    if client is None or not keys:
+        return
+    try:
+        await client.delete(*keys)
+    except (redis.RedisError, OSError) as e:
+        logger.warning("Redis DEL %s failed: %s", ", ".join(keys), e)
+
+
+async def delete_matching(pattern: str) -> None:
+    """Remove every key matching a glob pattern (incrementally, via SCAN); failures are logged and ignored"""
+    client = _get_client()
+    if client is None:
+        return
+    try:
+        keys = [key async for key in client.scan_iter(match=pattern, count=500)]
+        if keys:
+            await client.delete(*keys)
+    except (redis.RedisError, OSError) as e:
+        logger.warning("Redis DEL %s failed: %s", pattern, e)
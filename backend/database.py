@@ -1,18 +1,39 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Boolean
+from sqlalchemy import create_engine, event, inspect, Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Index, Float
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from sqlalchemy.orm import sessionmaker, relationship, raiseload
+from sqlalchemy.pool import QueuePool
+from datetime import datetime, timedelta
+import hashlib
 import os
 
 # Create SQLite database URL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chat_history.db")
 
-# Create engine
+# Create engine with a connection pool so requests reuse open connections
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False}  # Needed for SQLite
+    connect_args={"check_same_thread": False},  # Needed for SQLite
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
+    pool_recycle=300
 )
 
+# Tune SQLite for the chat write pattern: WAL lets reads run alongside writes, and
+# synchronous=NORMAL skips the fsync on every commit (the WAL is synced at checkpoints)
+if DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.execute("PRAGMA cache_size=-64000")  # ~64 MB
+        cursor.execute("PRAGMA foreign_keys=ON")  # Enforce ON DELETE CASCADE
+        cursor.close()
+
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -31,6 +52,9 @@ class User(Base):
 
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        Index("ix_chats_user_updated", "user_id", "updated_at"),  # get_all_chats: filter by user, newest first
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=True)  # Auto-generated title from first message
@@ -42,10 +66,19 @@ class Chat(Base):
 
     # Relationship with user and messages
     user = relationship("User", back_populates="chats")
-    messages = relationship("Message", back_populates="chat", order_by="Message.created_at")
+    messages = relationship(
+        "Message",
+        back_populates="chat",
+        order_by="Message.created_at",
+        cascade="all, delete-orphan",
+        passive_deletes=True  # Let the database cascade deletes instead of loading every message
+    )
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_created", "chat_id", "created_at"),  # get_chat_history: filter by chat, oldest first
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     role = Column(String, nullable=False)  # 'user' or 'assistant'
@@ -53,20 +86,69 @@ class Message(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Additional fields for stock data
-    price = Column(String, nullable=True)  # JSON string for price data
-    change_percent = Column(String, nullable=True)  # JSON string for change data
+    price = Column(Float, nullable=True)  # Stock price at the time of the message
+    change_percent = Column(Float, nullable=True)  # Daily change in percent
     monthly_data = Column(Text, nullable=True)  # JSON string for chart data
     comparison_data = Column(Text, nullable=True)  # JSON string for comparison chart data
 
     # Foreign key to chat
-    chat_id = Column(Integer, ForeignKey("chats.id"))
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"))
 
     # Relationship with chat
     chat = relationship("Chat", back_populates="messages")
 
+class TickerCache(Base):
+    __tablename__ = "ticker_cache"
+
+    query_hash = Column(String, primary_key=True)  # md5 of the normalized query text
+    tickers = Column(Text, nullable=True)  # Comma-separated tickers, NULL when the LLM answered "NONE"
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 # Create tables
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    _migrate_messages_table()
+    _create_missing_indexes()
+
+def _migrate_messages_table():
+    """Rebuild messages tables created by older schemas: chat_id without ON DELETE CASCADE,
+    or price/change_percent stored as strings"""
+    if not DATABASE_URL.startswith("sqlite"):
+        return
+    inspector = inspect(engine)
+    has_cascade = any(
+        fk["options"].get("ondelete", "").upper() == "CASCADE"
+        for fk in inspector.get_foreign_keys("messages")
+    )
+    column_types = {column["name"]: column["type"] for column in inspector.get_columns("messages")}
+    has_float_prices = all(isinstance(column_types.get(name), Float) for name in ("price", "change_percent"))
+    if has_cascade and has_float_prices:
+        return
+
+    # SQLite can't alter a foreign key or column type in place, so copy the rows into a freshly
+    # created table, casting the numeric strings to REAL. Messages orphaned by the old delete path
+    # (chat_id NULL or dangling) are unreachable and dropped.
+    columns = ", ".join(column.name for column in Message.__table__.columns)
+    select_columns = ", ".join(
+        f"CAST(NULLIF({column.name}, '') AS REAL)" if column.name in ("price", "change_percent") else column.name
+        for column in Message.__table__.columns
+    )
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE messages RENAME TO messages_old")
+        for index in Message.__table__.indexes:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+        Message.__table__.create(bind=conn)
+        conn.exec_driver_sql(
+            f"INSERT INTO messages ({columns}) SELECT {select_columns} FROM messages_old "
+            "WHERE chat_id IN (SELECT id FROM chats)"
+        )
+        conn.exec_driver_sql("DROP TABLE messages_old")
+
+def _create_missing_indexes():
+    # create_all() skips tables that already exist, so indexes added to an existing table need their own pass
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 # Dependency to get database session
 def get_db():
@@ -76,21 +158,36 @@ def get_db():
     finally:
         db.close()
 
+# The default user never changes once created, so its id is looked up only once per process
+_DEFAULT_USER_ID = None
+
 # Helper functions
 def get_or_create_default_user(db):
     """Get or create the default user"""
+    global _DEFAULT_USER_ID
+    if _DEFAULT_USER_ID is not None:
+        user = db.get(User, _DEFAULT_USER_ID)
+        if user:
+            return user
+
     user = db.query(User).filter(User.username == "default_user").first()
     if not user:
         user = User(username="default_user")
         db.add(user)
         db.commit()
         db.refresh(user)
+    _DEFAULT_USER_ID = user.id
     return user
 
+def get_default_user_id(db):
+    """Get the default user's id, hitting the database only on first use"""
+    if _DEFAULT_USER_ID is None:
+        get_or_create_default_user(db)
+    return _DEFAULT_USER_ID
+
 def create_chat(db, title=None):
     """Create a new chat session"""
-    user = get_or_create_default_user(db)
-    chat = Chat(user_id=user.id, title=title)
+    chat = Chat(user_id=get_default_user_id(db), title=title)
     db.add(chat)
     db.commit()
     db.refresh(chat)
@@ -98,12 +195,18 @@ def create_chat(db, title=None):
 
 def get_chat_history(db, chat_id):
     """Get all messages for a chat"""
-    return db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.created_at).all()
+    # raiseload guards the history endpoint against accidental per-row lazy loads
+    return (
+        db.query(Message)
+        .options(raiseload("*"))
+        .filter(Message.chat_id == chat_id)
+        .order_by(Message.created_at, Message.id)
+        .all()
+    )
 
 def get_all_chats(db):
     """Get all chats for the default user"""
-    user = get_or_create_default_user(db)
-    return db.query(Chat).filter(Chat.user_id == user.id).order_by(Chat.updated_at.desc()).all()
+    return db.query(Chat).filter(Chat.user_id == get_default_user_id(db)).order_by(Chat.updated_at.desc()).all()
 
 def add_message_to_chat(db, chat_id, role, content, price=None, change_percent=None, monthly_data=None, comparison_data=None):
     """Add a message to a chat"""
@@ -119,19 +222,53 @@ def add_message_to_chat(db, chat_id, role, content, price=None, change_percent=N
     db.add(message)
 
     # Update chat's updated_at timestamp
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
-    if chat:
-        chat.updated_at = datetime.utcnow()
+    db.query(Chat).filter(Chat.id == chat_id).update({Chat.updated_at: datetime.utcnow()}, synchronize_session=False)
 
     db.commit()
     db.refresh(message)
     return message
 
+def add_messages_bulk(db, chat_id, messages):
+    """Add several messages to a chat in a single transaction"""
+    db.bulk_save_objects([Message(chat_id=chat_id, **message) for message in messages])
+
+    # Update chat's updated_at timestamp
+    db.query(Chat).filter(Chat.id == chat_id).update({Chat.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+    db.commit()
+
+def delete_chat_session(db, chat_id):
+    """Delete a chat and, via ON DELETE CASCADE, its messages; returns True if the chat existed"""
+    deleted = db.query(Chat).filter(Chat.id == chat_id).delete(synchronize_session=False)
+    db.commit()
+    return deleted > 0
+
 def update_chat_title(db, chat_id, title):
-    """Update chat title"""
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
-    if chat:
-        chat.title = title
-        db.commit()
-    return chat
+    """Update chat title, returning True if the chat exists"""
+    updated = db.query(Chat).filter(Chat.id == chat_id).update({Chat.title: title}, synchronize_session=False)
+    db.commit()
+    return updated > 0
 
+def _hash_query(query):
+    return hashlib.md5(query.encode("utf-8")).hexdigest()
+
+def get_cached_tickers(db, query, none_max_age_days=7):
+    """Get (tickers, cached_at) for a normalized query, or None on a cache miss"""
+    entry = db.get(TickerCache, _hash_query(query))
+    if not entry:
+        return None
+    if entry.tickers is None:
+        # "NONE" answers expire so newly listed tickers eventually get picked up
+        if datetime.utcnow() - entry.created_at > timedelta(days=none_max_age_days):
+            return None
+        return [], entry.created_at
+    return entry.tickers.split(","), entry.created_at
+
+def cache_tickers(db, query, tickers):
+    """Store the tickers extracted for a normalized query"""
+    db.merge(TickerCache(
+        query_hash=_hash_query(query),
+        tickers=",".join(tickers) if tickers else None,
+        created_at=datetime.utcnow()
+    ))
+    db.commit()
@@ -1,25 +1,65 @@
 import os
+import re
 import json
+import asyncio
+import logging
+import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager, suppress
+from functools import lru_cache
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
 from typing import Dict, Any, List, TypedDict, Optional, Union
 from langgraph.graph import StateGraph, END
+from langgraph.config import get_stream_writer
 from langfuse import Langfuse
+from cachetools import TTLCache
 
-from tools import get_stock_data, generate_stock_response, get_monthly_stock_data
-from database import create_tables, get_db, create_chat, add_message_to_chat, get_chat_history, get_all_chats, update_chat_title
+try:
+    import orjson
+except ImportError:  # orjson ships with fastapi[all]; fall back to the stdlib encoder without it
+    orjson = None
 
-# Load environment variables from .env file
+# Load environment variables from .env file before the local modules read their settings
 load_dotenv()
 
-# Create database tables
-create_tables()
+import cache as cache_store
+from tools import (
+    StockSnapshot, fetch_stock_data, fetch_monthly_stock_data, fetch_monthly_stock_data_batch, prefetch_history,
+    invalidate_stock_data, generate_stock_response, generate_llm_text, run_cache_refresher, wants_chart,
+    CHART_FROM_HISTORY, REFRESH_INTERVAL, LLM_TIMEOUT
+)
+from database import create_tables, get_db, SessionLocal, create_chat, add_message_to_chat, add_messages_bulk, get_chat_history, get_all_chats, update_chat_title, delete_chat_session, get_cached_tickers, cache_tickers
+
+# Set up logging; node traces are debug-level so they aren't even formatted at the default level.
+# LOG_LEVEL=DEBUG turns them on (the tools and cache loggers inherit this level).
+logger = logging.getLogger("stockstalk")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(levelname)s:     %(name)s - %(message)s"))
+    logger.addHandler(_log_handler)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables once the server starts rather than whenever the module is imported
+    create_tables()
+    # Keep the most requested tickers warm in the cache (REFRESH_INTERVAL=0 disables it)
+    refresher = asyncio.create_task(run_cache_refresher()) if REFRESH_INTERVAL > 0 else None
+    yield
+    if refresher:
+        refresher.cancel()
+        with suppress(asyncio.CancelledError):
+            await refresher
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse if orjson else JSONResponse)
 
 # Get configuration from environment variables
 google_api_key = os.getenv("GOOGLE_API_KEY")
@@ -41,96 +81,272 @@ try:
             secret_key=langfuse_secret_key,
             host=langfuse_base_url
         )
-        print("✓ Langfuse tracing initialized successfully")
+        logger.info("✓ Langfuse tracing initialized successfully")
     else:
-        print("⚠ Langfuse credentials not found - tracing disabled")
+        logger.info("⚠ Langfuse credentials not found - tracing disabled")
 except Exception as e:
-    print(f"⚠ Langfuse initialization failed: {e} - tracing disabled")
+    logger.warning("⚠ Langfuse initialization failed: %s - tracing disabled", e)
     langfuse_client = None
 
-# Initialize the Gemini model
+# Initialize the Gemini models
 llm = ChatGoogleGenerativeAI(model=gemini_model, google_api_key=google_api_key)
 
+# Ticker extraction only needs a short comma-separated list, so it gets a deterministic, tightly capped
+# config. On Gemini 2.5 thinking tokens count toward max_output_tokens, so thinking is turned off where
+# the model allows it (Flash models); otherwise the cap is left loose enough for the thinking budget.
+_ticker_can_skip_thinking = "flash" in gemini_model
+llm_ticker = ChatGoogleGenerativeAI(
+    model=gemini_model,
+    google_api_key=google_api_key,
+    temperature=0,
+    max_output_tokens=64 if _ticker_can_skip_thinking else None,
+    thinking_budget=0 if _ticker_can_skip_thinking else None
+)
+
+
+class TickerList(BaseModel):
+    tickers: List[str] = Field(default_factory=list, description="Uppercase stock ticker symbols found in the query; empty if there are none")
+
+
+# Function calling makes Gemini return a typed list instead of free text that has to be parsed
+ticker_extractor = llm_ticker.with_structured_output(TickerList)
+
+# Ticker extraction cache: an in-process LRU in front of the persistent ticker_cache table
+TICKER_CACHE_SIZE = int(os.getenv("TICKER_CACHE_SIZE", "1024"))
+TICKER_CACHE_NONE_DAYS = int(os.getenv("TICKER_CACHE_NONE_DAYS", "7"))
+_ticker_cache: "OrderedDict[str, tuple[List[str], datetime]]" = OrderedDict()
+
+
+def _get_cached_tickers(cache_key: str) -> List[str] | None:
+    """Return cached tickers for a normalized query ([] means no tickers), or None on a miss."""
+    entry = _ticker_cache.get(cache_key)
+    if entry is not None:
+        tickers, cached_at = entry
+        if tickers or datetime.utcnow() - cached_at <= timedelta(days=TICKER_CACHE_NONE_DAYS):
+            _ticker_cache.move_to_end(cache_key)
+            return tickers
+        del _ticker_cache[cache_key]
+
+    db = SessionLocal()
+    try:
+        cached = get_cached_tickers(db, cache_key, TICKER_CACHE_NONE_DAYS)
+    finally:
+        db.close()
+
+    if cached is None:
+        return None
+    # Keep the row's timestamp so a restart doesn't restart the expiry window of "no tickers" answers
+    tickers, cached_at = cached
+    _remember_tickers(cache_key, tickers, cached_at)
+    return tickers
+
+
+def _remember_tickers(cache_key: str, tickers: List[str], cached_at: datetime | None = None):
+    _ticker_cache[cache_key] = (tickers, cached_at or datetime.utcnow())
+    _ticker_cache.move_to_end(cache_key)
+    while len(_ticker_cache) > TICKER_CACHE_SIZE:
+        _ticker_cache.popitem(last=False)
+
+
+def _cache_tickers(cache_key: str, tickers: List[str]):
+    _remember_tickers(cache_key, tickers)
+    db = SessionLocal()
+    try:
+        cache_tickers(db, cache_key, tickers)
+    finally:
+        db.close()
+
+# Bound concurrent per-ticker work within one request; each node call gets its own semaphore, so one user's
+# long question can't hold up another's. Yahoo traffic across requests is capped by tools.YF_MAX_CONCURRENCY.
+TICKER_CONCURRENCY = int(os.getenv("TICKER_CONCURRENCY", "5"))
+
 
 # Define the AgentState
 class AgentState(TypedDict):
     query: str
     tickers: List[str] | None
-    stock_data: Dict[str, Any] | None
+    stock_data: StockSnapshot | None
     final_response: List[Dict[str, Any]] | Dict[str, Any] | None
+    streaming: bool  # Answers reach the client token by token (/chat/stream)
+
+
+# Cheap pre-pass ahead of the LLM: well-known uppercase tickers and plain greetings resolve locally
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "known_tickers.json")) as f:
+    KNOWN_TICKERS = frozenset(json.load(f))
+TICKER_CANDIDATE_RE = re.compile(r"\b[A-Z]{2,5}\b")
+# Anything that might name another company: single-letter or unknown symbols, lowercase tickers, capitalized words
+OTHER_SYMBOL_RE = re.compile(r"\b(?:[B-HJ-Z]|[A-Z]{2,5})\b")
+WORD_RE = re.compile(r"\b[A-Za-z]+\b")
+CAPITALIZED_WORD_RE = re.compile(r"\b[A-Z][a-z]+\b")
+GREETINGS = frozenset({
+    'hi', 'hello', 'hey', 'hi there', 'hello there', 'hey there', 'yo',
+    'good morning', 'good afternoon', 'good evening', 'how are you',
+    'thanks', 'thank you', 'bye', 'goodbye'
+})
+
+
+def _match_known_tickers(query: str) -> List[str]:
+    """Known tickers written in uppercase in the query, in order of first mention."""
+    return [ticker for ticker in dict.fromkeys(TICKER_CANDIDATE_RE.findall(query)) if ticker in KNOWN_TICKERS]
+
+
+def _mentions_other_companies(query: str) -> bool:
+    """Whether the query may name a company the known-ticker match missed."""
+    if any(symbol not in KNOWN_TICKERS for symbol in OTHER_SYMBOL_RE.findall(query)):
+        return True
+    if any(word.upper() in KNOWN_TICKERS for word in WORD_RE.findall(query) if word.islower()):
+        return True
+    for match in CAPITALIZED_WORD_RE.finditer(query):
+        before = query[:match.start()].rstrip()
+        # Sentence-initial capitals are just grammar; anything else may be a company name
+        if before and before[-1] not in ".!?\"'":
+            return True
+    return False
+
+
+def _resolve_known_tickers(query: str) -> List[str] | None:
+    """
+    Tickers for the query when the local pre-pass accounts for every company in it, else None so the
+    LLM extracts them. Comparisons need at least two matched tickers.
+    """
+    tickers = _match_known_tickers(query)
+    if not tickers or _mentions_other_companies(query):
+        return None
+    if len(tickers) < 2 and COMPARE_RE.search(query.lower()):
+        return None
+    return tickers
+
+
+# Static system prompts, built once and shared by every request
+TICKER_SYSTEM_MESSAGE = SystemMessage(content="""You are an expert at parsing financial requests. Extract ALL stock ticker symbols from the user query.
+
+Rules:
+- Look for common stock tickers (1-5 characters, uppercase)
+- Common examples: AAPL, MSFT, GOOGL, TSLA, AMZN, NVDA, etc.
+- If multiple tickers are mentioned, list them all
+- If no tickers are found, return an empty list
+
+Examples:
+Query: "How is AAPL doing?" → [AAPL]
+Query: "Compare MSFT and GOOGL" → [MSFT, GOOGL]
+Query: "What about TSLA stock?" → [TSLA]
+Query: "What is inflation?" → []""")
+
+# System prompt to keep general answers within the finance domain
+FINANCE_SYSTEM_MESSAGE = SystemMessage(content="""You are Stock Stalk, a friendly AI Finance Agent who helps users with financial questions, market insights, and investment education.
+
+IMPORTANT GUIDELINES:
+- Always stay within finance, investing, markets, and economic topics
+- Be conversational, friendly, and engaging - like a knowledgeable financial advisor friend
+- For greetings (hi, hello, etc.): Respond warmly and naturally, then gently steer toward finance topics
+- If asked about non-finance topics, politely redirect back to finance with a smooth transition
+- Provide accurate information and remind users to do their own research
+- Keep responses informative but not overwhelming
+- Use natural, conversational language
+- NEVER use emojis, special characters, or Unicode symbols in your responses
+- IMPORTANT: Do NOT always start with greetings - respond naturally based on context
+
+Examples of good responses:
+- To "Hi!": "Hello! Great to meet you. I'm Stock Stalk, your AI finance companion. What financial topics are you interested in today?"
+- To "How are you?": "I'm doing great, thanks for asking! Always excited to help with financial questions. What's on your mind today?"
+- To "Can you give me a list of known ticker symbols?": "I'd be happy to help with some popular ticker symbols! Here are some well-known ones: AAPL (Apple), MSFT (Microsoft), GOOGL (Alphabet), AMZN (Amazon), TSLA (Tesla), NVDA (Nvidia), and META (Meta Platforms). These are some of the largest and most actively traded companies. What specific sector or type of company are you interested in?"
+- To general questions: Provide direct, helpful answers without forced greetings
+
+Respond naturally while staying within these finance guidelines and avoiding all emojis and special characters.""")
 
 
 # LangGraph Nodes
 async def extract_ticker_node(state: AgentState) -> AgentState:
-    print("---EXTRACTING TICKERS---")
+    logger.debug("extracting tickers")
     query = state["query"]
-    
-    prompt = f"""
-    You are an expert at parsing financial requests. Extract ALL stock ticker symbols from the following user query.
-
-    Rules:
-    - Look for common stock tickers (1-5 characters, uppercase)
-    - Common examples: AAPL, MSFT, GOOGL, TSLA, AMZN, NVDA, etc.
-    - If multiple tickers are mentioned, list them all
-    - Respond with ONLY a comma-separated list of uppercase tickers
-    - If no tickers are found, respond with "NONE"
-
-    Examples:
-    Query: "How is AAPL doing?" → AAPL
-    Query: "Compare MSFT and GOOGL" → MSFT,GOOGL
-    Query: "What about TSLA stock?" → TSLA
-
-    User Query: "{query}"
-    """
+
+    known_tickers = _resolve_known_tickers(query)
+    if known_tickers:
+        return {"tickers": known_tickers}
+
+    cache_key = query.strip().lower()
+    if cache_key.rstrip("!.?, ") in GREETINGS:
+        return {"tickers": None}
+
+    # Identical queries always resolve to the same tickers, so skip the Gemini round-trip
+    cached_tickers = _get_cached_tickers(cache_key)
+    if cached_tickers is not None:
+        return {"tickers": cached_tickers or None}
 
     messages = [
-        SystemMessage(content=prompt),
+        TICKER_SYSTEM_MESSAGE,
         HumanMessage(content=f"User Query: \"{query}\"")
     ]
     
-    response = await llm.ainvoke(messages)
-    content = response.content.strip().upper()
+    result = await ticker_extractor.ainvoke(messages)
+
+    # Normalize and drop repeats so each ticker is fetched once; no tool call means no tickers
+    raw_tickers = result.tickers if result else []
+    tickers = list(dict.fromkeys(ticker.strip().upper() for ticker in raw_tickers if ticker.strip()))
+    _cache_tickers(cache_key, tickers)
+    return {"tickers": tickers or None}
+
+async def _process_one(ticker: str, query: str, streaming: bool, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    async with semaphore:
+        logger.debug("processing %s", ticker)
+
+        # Fetch real-time and chart data together; both come from the same cached history download
+        fetches = [fetch_stock_data(ticker)]
+        if wants_chart(query):
+            fetches.append(fetch_monthly_stock_data(ticker))
+        stock_data, *chart = await asyncio.gather(*fetches)
+        monthly_data = chart[0] if chart else None
+        if not stock_data:
+            # Create error response for this ticker
+            return {
+                "message": f"I couldn't fetch data for {ticker}. Please check the ticker symbol and try again.",
+                "price": None,
+                "changePercent": None,
+                "monthlyData": None
+            }
 
-    if content == "NONE" or not content:
-        return {"tickers": None}
-    else:
-        # Split by comma and clean up
-        tickers = [ticker.strip() for ticker in content.split(',') if ticker.strip()]
-        return {"tickers": tickers}
+        # Generate structured response with reasoning; /chat/stream gets the price and chart ahead of the text
+        return await generate_stock_response(
+            stock_data, query, llm,
+            monthly_data=monthly_data, chart_fetched=True, on_meta=get_stream_writer(), streaming=streaming
+        )
 
 async def process_multiple_stocks_node(state: AgentState) -> AgentState:
-    print("---PROCESSING MULTIPLE STOCKS---")
+    logger.debug("processing multiple stocks")
     tickers = state["tickers"]
     query = state["query"]
 
     if not tickers:
         return {"stock_data": None, "final_response": "I couldn't identify any stock tickers in your message. Please provide valid ticker symbols like 'AAPL' or 'MSFT'."}
 
-    responses = []
-
-    for ticker in tickers:
-        print(f"---PROCESSING {ticker}---")
-
-        # Fetch real-time stock data
-        stock_data = get_stock_data(ticker)
-        if not stock_data:
-            # Create error response for this ticker
-            responses.append({
-                "message": f"I couldn't fetch data for {ticker}. Please check the ticker symbol and try again.",
-                "price": None,
-                "changePercent": None,
-                "monthlyData": None
-            })
-            continue
-
-        # Generate structured response with reasoning
-        response_data = await generate_stock_response(stock_data, query, llm)
-        responses.append(response_data)
-
-    return {"stock_data": None, "final_response": responses}
+    # One batched history download for all tickers, then per-ticker work concurrently;
+    # gather keeps the responses in ticker order
+    await prefetch_history(tickers)
+    semaphore = asyncio.Semaphore(TICKER_CONCURRENCY)
+    responses = await asyncio.gather(
+        *(_process_one(ticker, query, state.get("streaming", False), semaphore) for ticker in tickers)
+    )
+
+    return {"stock_data": None, "final_response": list(responses)}
+
+async def _fetch_quote(ticker: str, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        return await fetch_stock_data(ticker)
+
+async def _fetch_comparison_data(tickers: List[str]):
+    # One batched history download for all tickers first, so the quote lookups below find it cached
+    await prefetch_history(tickers)
+    semaphore = asyncio.Semaphore(TICKER_CONCURRENCY)
+    quotes = asyncio.gather(*(_fetch_quote(ticker, semaphore) for ticker in tickers))
+    if CHART_FROM_HISTORY:
+        # Charts are derived from the same history, so they match the single-stock ones cached under the same key
+        quotes, charts = await asyncio.gather(quotes, asyncio.gather(*(fetch_monthly_stock_data(ticker) for ticker in tickers)))
+        return quotes, dict(zip(tickers, charts))
+    # Otherwise the charts need their own history, fetched for every ticker in one batched download
+    return await asyncio.gather(quotes, fetch_monthly_stock_data_batch(tickers))
 
 async def handle_stock_comparison_node(state: AgentState) -> AgentState:
-    print("---HANDLING STOCK COMPARISON---")
+    logger.debug("handling stock comparison")
     tickers = state["tickers"]
     query = state["query"]
 
@@ -142,19 +358,21 @@ async def handle_stock_comparison_node(state: AgentState) -> AgentState:
             "monthlyData": None
         }}
 
-    # Fetch data for all tickers (removed 5 ticker limit)
+    # Fetch data for all tickers concurrently (removed 5 ticker limit)
     comparison_data = []
     valid_tickers = []
 
-    for ticker in tickers[:10]:  # Increased limit to 10 tickers
-        stock_data = get_stock_data(ticker)
-        monthly_data = get_monthly_stock_data(ticker)
+    tickers = tickers[:10]  # Increased limit to 10 tickers
+    quotes, monthly_by_ticker = await _fetch_comparison_data(tickers)
+
+    for ticker, stock_data in zip(tickers, quotes):
+        monthly_data = monthly_by_ticker.get(ticker)
         if stock_data and monthly_data and len(monthly_data.get('data', [])) > 0:
             valid_tickers.append(ticker)
             comparison_data.append({
                 "ticker": ticker,
-                "currentPrice": stock_data.get('currentPrice', 0),
-                "dailyChangePercent": stock_data.get('dailyChangePercent', 0),
+                "currentPrice": stock_data.current_price or 0,
+                "dailyChangePercent": stock_data.daily_change_percent or 0,
                 "monthlyData": monthly_data['data']
             })
 
@@ -178,42 +396,46 @@ async def handle_stock_comparison_node(state: AgentState) -> AgentState:
         "comparisonData": comparison_data
     }}
 
-async def handle_general_finance_node(state: AgentState) -> AgentState:
-    print("---HANDLING GENERAL FINANCE QUESTION---")
-    query = state["query"]
+# General finance answers depend only on the question, so repeated chitchat/FAQ queries skip Gemini.
+# Kept in-process and, when configured, in Redis so other workers share them.
+_general_response_cache = TTLCache(maxsize=1024, ttl=3600)
 
-    # System prompt to keep responses within finance domain
-    system_prompt = """You are Stock Stalk, a friendly AI Finance Agent who helps users with financial questions, market insights, and investment education.
+def _general_cache_key(query: str) -> str:
+    return "general:" + hashlib.md5(query.strip().lower().encode("utf-8")).hexdigest()
 
-IMPORTANT GUIDELINES:
-- Always stay within finance, investing, markets, and economic topics
-- Be conversational, friendly, and engaging - like a knowledgeable financial advisor friend
-- For greetings (hi, hello, etc.): Respond warmly and naturally, then gently steer toward finance topics
-- If asked about non-finance topics, politely redirect back to finance with a smooth transition
-- Provide accurate information and remind users to do their own research
-- Keep responses informative but not overwhelming
-- Use natural, conversational language
-- NEVER use emojis, special characters, or Unicode symbols in your responses
-- IMPORTANT: Do NOT always start with greetings - respond naturally based on context
+async def handle_general_finance_node(state: AgentState) -> AgentState:
+    logger.debug("handling general finance question")
+    query = state["query"]
 
-Examples of good responses:
-- To "Hi!": "Hello! Great to meet you. I'm Stock Stalk, your AI finance companion. What financial topics are you interested in today?"
-- To "How are you?": "I'm doing great, thanks for asking! Always excited to help with financial questions. What's on your mind today?"
-- To "Can you give me a list of known ticker symbols?": "I'd be happy to help with some popular ticker symbols! Here are some well-known ones: AAPL (Apple), MSFT (Microsoft), GOOGL (Alphabet), AMZN (Amazon), TSLA (Tesla), NVDA (Nvidia), and META (Meta Platforms). These are some of the largest and most actively traded companies. What specific sector or type of company are you interested in?"
-- To general questions: Provide direct, helpful answers without forced greetings
+    cache_key = _general_cache_key(query)
+    cached_content = _general_response_cache.get(cache_key)
+    if cached_content is None:
+        cached_content = await cache_store.get_json(cache_key)
+        if cached_content is not None:
+            _general_response_cache[cache_key] = cached_content
+    if cached_content is not None:
+        return {"final_response": {
+            "message": cached_content,
+            "price": None,
+            "changePercent": None,
+            "monthlyData": None
+        }}
 
-Respond naturally while staying within these finance guidelines and avoiding all emojis and special characters."""
-    
     messages = [
-        SystemMessage(content=system_prompt),
+        FINANCE_SYSTEM_MESSAGE,
         HumanMessage(content=query)
     ]
     
     try:
-        response = await llm.ainvoke(messages)
-        message_content = response.content
+        message_content = await generate_llm_text(llm, messages, state.get("streaming", False))
+        # Only real answers are cached, never the fallback text below
+        _general_response_cache[cache_key] = message_content
+        await cache_store.set_json(cache_key, message_content, int(_general_response_cache.ttl))
     except Exception as e:
-        print(f"Error generating general finance response: {e}")
+        if isinstance(e, asyncio.TimeoutError):
+            logger.warning("LLM timed out after %ss generating a general finance response", LLM_TIMEOUT)
+        else:
+            logger.error("Error generating general finance response: %s", e)
         # Fallback response
         if "list of known ticker symbols" in query.lower() or "ticker symbols" in query.lower():
             message_content = "I'd be happy to help with some popular ticker symbols! Here are some well-known ones: AAPL (Apple), MSFT (Microsoft), GOOGL (Alphabet), AMZN (Amazon), TSLA (Tesla), NVDA (Nvidia), and META (Meta Platforms). These are some of the largest and most actively traded companies. What specific sector or type of company are you interested in?"
@@ -228,7 +450,7 @@ Respond naturally while staying within these finance guidelines and avoiding all
     }}
 
 async def handle_no_ticker_node(state: AgentState) -> AgentState:
-    print("---HANDLING NO TICKER---")
+    logger.debug("handling no ticker")
     return {"final_response": {
         "message": "I couldn't find a stock ticker in your request. Please provide a valid ticker symbol, like 'AAPL' or 'MSFT'.",
         "price": None,
@@ -236,6 +458,58 @@ async def handle_no_ticker_node(state: AgentState) -> AgentState:
         "monthlyData": None
     }}
 
+# Routing keywords, compiled once so each check is a single scan over the query
+COMPARE_KEYWORDS = frozenset({
+    'compare', 'comparison', 'comparing', 'vs', 'versus', 'against',
+    'chart', 'graph', 'plot', 'visualize', 'show me', 'display'
+})
+FINANCE_KEYWORDS = frozenset({
+    'stock', 'market', 'invest', 'finance', 'trading', 'economy', 'bond', 'etf', 'mutual fund',
+    'portfolio', 'dividend', 'earnings', 'ipo', 'crypto', 'bitcoin', 'forex', 'currency',
+    'interest rate', 'inflation', 'recession', 'bull market', 'bear market', 'volatility',
+    'risk', 'return', 'p/e ratio', 'dividend yield', 'market cap', 'valuation', 'technical analysis',
+    'fundamental analysis', 'options', 'futures', 'commodities', 'gold', 'oil', 'real estate',
+    'retirement', '401k', 'ira', 'tax', 'capital gains', 'broker', 'trading platform',
+    'how to invest', 'investment strategy', 'financial planning', 'wealth management',
+    'passive income', 'side hustle', 'financial freedom', 'money management',
+    'ticker', 'symbol', 'symbols', 'list', 'known', 'popular', 'famous', 'biggest', 'largest'
+})
+INDICATOR_KEYWORDS = frozenset({
+    'what is', 'how does', 'explain', 'tell me about', 'what does', 'why do', 'how do',
+    'what are', 'how to', 'what should', 'advice', 'recommend', 'opinion', 'thoughts',
+    'can you', 'could you', 'would you', 'give me', 'show me', 'tell me',
+    'hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'how are you',
+    'what\'s up', 'how\'s it going', 'nice to meet you', 'thanks', 'thank you', 'bye', 'goodbye'
+})
+
+
+def _compile_keywords(keywords: frozenset) -> re.Pattern:
+    # Plain substring alternation over lowercase keywords, same semantics as `keyword in query.lower()`
+    return re.compile("|".join(map(re.escape, sorted(keywords, key=len, reverse=True))))
+
+
+COMPARE_RE = _compile_keywords(COMPARE_KEYWORDS)
+# Finance topics and conversational indicators both route to the general finance node
+GENERAL_FINANCE_RE = _compile_keywords(FINANCE_KEYWORDS | INDICATOR_KEYWORDS)
+
+
+@lru_cache(maxsize=2048)
+def _classify(query: str, ticker_count: int) -> str:
+    """Classify a lowercased query; memoized since the result depends only on these two inputs."""
+    if ticker_count >= 2 and COMPARE_RE.search(query):
+        return "stock_comparison"
+    if ticker_count:
+        return "tickers_found"
+    if GENERAL_FINANCE_RE.search(query):
+        return "general_finance"
+    return "no_ticker"
+
+
+def _route(state: AgentState) -> str:
+    """Pick the next node based on the extracted tickers and the query wording."""
+    return _classify(state["query"].lower(), len(state["tickers"] or ()))
+
+
 # Define the LangGraph workflow
 workflow = StateGraph(AgentState)
 
@@ -252,35 +526,7 @@ workflow.set_entry_point("extract_ticker")
 # Add edges
 workflow.add_conditional_edges(
     "extract_ticker",
-    lambda state: (
-        "stock_comparison" if (
-            state["tickers"] and len(state["tickers"]) >= 2 and
-            any(word in state["query"].lower() for word in [
-                'compare', 'comparison', 'comparing', 'vs', 'versus', 'versus', 'against',
-                'chart', 'graph', 'plot', 'visualize', 'show me', 'display'
-            ])
-        ) else (
-            "tickers_found" if state["tickers"] else (
-                "general_finance" if any(keyword in state["query"].lower() for keyword in [
-                    'stock', 'market', 'invest', 'finance', 'trading', 'economy', 'bond', 'etf', 'mutual fund',
-                    'portfolio', 'dividend', 'earnings', 'ipo', 'crypto', 'bitcoin', 'forex', 'currency',
-                    'interest rate', 'inflation', 'recession', 'bull market', 'bear market', 'volatility',
-                    'risk', 'return', 'p/e ratio', 'dividend yield', 'market cap', 'valuation', 'technical analysis',
-                    'fundamental analysis', 'options', 'futures', 'commodities', 'gold', 'oil', 'real estate',
-                    'retirement', '401k', 'ira', 'tax', 'capital gains', 'broker', 'trading platform',
-                    'how to invest', 'investment strategy', 'financial planning', 'wealth management',
-                    'passive income', 'side hustle', 'financial freedom', 'money management',
-                    'ticker', 'symbol', 'symbols', 'list', 'known', 'popular', 'famous', 'biggest', 'largest'
-                ]) or any(indicator in state["query"].lower() for indicator in [
-                    'what is', 'how does', 'explain', 'tell me about', 'what does', 'why do', 'how do',
-                    'what are', 'how to', 'what should', 'advice', 'recommend', 'opinion', 'thoughts',
-                    'can you', 'could you', 'would you', 'give me', 'show me', 'tell me',
-                    'hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'how are you',
-                    'what\'s up', 'how\'s it going', 'nice to meet you', 'thanks', 'thank you', 'bye', 'goodbye'
-                ]) else "no_ticker"
-            )
-        )
-    ),
+    _route,
     {
         "stock_comparison": "handle_stock_comparison",
         "tickers_found": "process_multiple_stocks",
@@ -295,7 +541,29 @@ workflow.add_edge("handle_general_finance", END)
 workflow.add_edge("handle_no_ticker", END)
 
 # Compile the graph
-app_graph = workflow.compile()
+# DEBUG_GRAPH=1 prints every graph step, which the /chat handler no longer does per request
+app_graph = workflow.compile(debug=bool(os.getenv("DEBUG_GRAPH")))
+
+
+def _round_floats(value):
+    if isinstance(value, float):
+        return round(float(value), 2)
+    if isinstance(value, dict):
+        return {key: _round_floats(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_round_floats(item) for item in value]
+    return value
+
+def _compact_json(value) -> str | None:
+    """Serialize chart data for storage: floats rounded to 2 decimals, no separator padding."""
+    if not value:
+        return None
+    if orjson:
+        return orjson.dumps(_round_floats(value), option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(_round_floats(value), separators=(",", ":"))
+
+def _load_json(value: str):
+    return orjson.loads(value) if orjson else json.loads(value)
 
 
 class ChatRequest(BaseModel):
@@ -306,110 +574,167 @@ class ChatRequest(BaseModel):
 async def read_root():
     return {"message": "Welcome to the FastAPI LangChain Gemini Stock Server!"}
 
+def _start_trace(request: ChatRequest):
+    """Create a Langfuse trace for this chat request, if tracing is enabled"""
+    if not langfuse_client:
+        return None
+    return langfuse_client.trace(
+        name="stock-chat",
+        input={"message": request.message, "session_id": request.session_id},
+        user_id=str(request.session_id) if request.session_id else "new_session"
+    )
+
+def _open_chat(db: Session, request: ChatRequest) -> int:
+    """Create or reuse the chat session and save the user's message; returns the chat id"""
+    if request.session_id:
+        # Use existing session
+        chat_id = request.session_id
+    else:
+        # Create new chat session with auto-generated title from first message
+        title = request.message[:50] + "..." if len(request.message) > 50 else request.message
+        chat = create_chat(db, title)
+        chat_id = chat.id
+
+    # Save user message to database
+    add_message_to_chat(db, chat_id, "user", request.message)
+    return chat_id
+
+def _save_assistant_responses(db: Session, chat_id: int, response_data) -> None:
+    """Save the graph's final response; multiple stock responses (list) become separate messages in one transaction"""
+    responses = response_data if isinstance(response_data, list) else [response_data]
+    add_messages_bulk(db, chat_id, [
+        {
+            "role": "assistant",
+            "content": single_response.get("message", ""),
+            "price": single_response.get("price"),
+            "change_percent": single_response.get("changePercent"),
+            "monthly_data": _compact_json(single_response.get("monthlyData")),
+            "comparison_data": _compact_json(single_response.get("comparisonData"))
+        }
+        for single_response in responses
+    ])
+
+def _initial_state(request: ChatRequest, streaming: bool = False) -> AgentState:
+    return {"query": request.message, "tickers": None, "stock_data": None, "final_response": None, "streaming": streaming}
+
 @app.post("/chat")
-async def chat_with_gemini(request: ChatRequest):
+async def chat_with_gemini(request: ChatRequest, db: Session = Depends(get_db)):
     # Create Langfuse trace for this chat session
-    trace = None
-    if langfuse_client:
-        trace = langfuse_client.trace(
-            name="stock-chat",
-            input={"message": request.message, "session_id": request.session_id},
-            user_id=str(request.session_id) if request.session_id else "new_session"
-        )
+    trace = _start_trace(request)
     
     try:
-        # Get database session
-        db = next(get_db())
-
-        # Create or get existing chat session
-        if request.session_id:
-            # Use existing session
-            chat_id = request.session_id
-        else:
-            # Create new chat session with auto-generated title from first message
-            title = request.message[:50] + "..." if len(request.message) > 50 else request.message
-            chat = create_chat(db, title)
-            chat_id = chat.id
-
-        # Save user message to database
-        add_message_to_chat(db, chat_id, "user", request.message)
+        chat_id = _open_chat(db, request)
 
-        # Initial state for the graph
-        initial_state = {"query": request.message, "tickers": None, "stock_data": None, "final_response": None}
-        
-        # Run the graph
-        # We iterate to get the final state after all nodes have run
-        final_state = None
-        async for s in app_graph.astream(initial_state):
-            print(s)
-            # Extract the actual state from the streamed result
-            if s:  # s is a dict like {'node_name': state}
-                final_state = list(s.values())[0]  # Get the state from the first (and only) value
+        # Run the graph to completion and take the terminal state
+        final_state = await app_graph.ainvoke(_initial_state(request))
 
         if final_state and final_state.get("final_response"):
             response_data = final_state["final_response"]
+            _save_assistant_responses(db, chat_id, response_data)
 
-            # Handle multiple responses (list) vs single response (dict)
-            if isinstance(response_data, list):
-                # Multiple stock responses - save each as a separate message
-                for i, single_response in enumerate(response_data):
-                    add_message_to_chat(
-                        db,
-                        chat_id,
-                        "assistant",
-                        single_response.get("message", ""),
-                        price=str(single_response.get("price")) if single_response.get("price") else None,
-                        change_percent=str(single_response.get("changePercent")) if single_response.get("changePercent") else None,
-                        monthly_data=json.dumps(single_response.get("monthlyData")) if single_response.get("monthlyData") else None,
-                        comparison_data=json.dumps(single_response.get("comparisonData")) if single_response.get("comparisonData") else None
-                    )
-                return {"response": response_data, "session_id": chat_id}
-            else:
-                # Single response
-                add_message_to_chat(
-                    db,
-                    chat_id,
-                    "assistant",
-                    response_data.get("message", ""),
-                    price=str(response_data.get("price")) if response_data.get("price") else None,
-                    change_percent=str(response_data.get("changePercent")) if response_data.get("changePercent") else None,
-                    monthly_data=json.dumps(response_data.get("monthlyData")) if response_data.get("monthlyData") else None,
-                    comparison_data=json.dumps(response_data.get("comparisonData")) if response_data.get("comparisonData") else None
-                )
-                
-                # Update Langfuse trace with output
-                if trace:
-                    trace.update(output={"response": "success", "session_id": chat_id})
-                    langfuse_client.flush()
-                
-                return {"response": response_data, "session_id": chat_id}
+            # Update Langfuse trace with output
+            if trace:
+                trace.update(output={"response": "success", "session_id": chat_id})
+                langfuse_client.flush()
+
+            # ORJSONResponse encodes numpy scalars from pandas natively, so skip jsonable_encoder's walk
+            if orjson:
+                return ORJSONResponse({"response": response_data, "session_id": chat_id})
+            return {"response": response_data, "session_id": chat_id}
         else:
             raise HTTPException(status_code=500, detail="Failed to generate a response from the stock agent.")
 
     except Exception as e:
-        print(f"Error in chat endpoint: {e}")
+        logger.error("Error in chat endpoint: %s", e)
         # Update trace with error
         if trace:
             trace.update(output={"error": str(e)})
             langfuse_client.flush()
         raise HTTPException(status_code=500, detail=str(e))
 
+# Graph nodes whose LLM output is forwarded token by token on /chat/stream
+STREAMED_NODES = frozenset({"handle_general_finance", "process_multiple_stocks"})
+
+def _sse(event: str, payload) -> str:
+    # Stock responses can carry numpy scalars from pandas; the stdlib encoder handles them as float subclasses
+    data = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY).decode() if orjson else json.dumps(payload)
+    return f"event: {event}\ndata: {data}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, db: Session = Depends(get_db)):
+    """
+    Server-Sent Events variant of /chat. Per-stock answers first emit a "meta" event ({"ticker", "price",
+    "changePercent", "monthlyData"}). "token" events ({"token": ...}, plus "ticker" for stock answers) follow
+    while a streamed node generates its answer, then one "done" event with the same body /chat returns
+    ({"response", "session_id"}), or an "error" event. The "done" payload is authoritative; meta and tokens
+    are only for progressive display.
+    """
+    trace = _start_trace(request)
+    try:
+        chat_id = _open_chat(db, request)
+    except Exception as e:
+        logger.error("Error in chat stream endpoint: %s", e)
+        if trace:
+            trace.update(output={"error": str(e)})
+            langfuse_client.flush()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        final_state = None
+        try:
+            async for mode, chunk in app_graph.astream(_initial_state(request, streaming=True), stream_mode=["messages", "values", "custom"]):
+                if mode == "values":
+                    final_state = chunk
+                    continue
+                if mode == "custom":
+                    yield _sse("meta", chunk)
+                    continue
+                message_chunk, metadata = chunk
+                if metadata.get("langgraph_node") in STREAMED_NODES and isinstance(message_chunk.content, str) and message_chunk.content:
+                    token = {"token": message_chunk.content}
+                    if "ticker" in metadata:
+                        token["ticker"] = metadata["ticker"]
+                    yield _sse("token", token)
+
+            if not final_state or not final_state.get("final_response"):
+                raise RuntimeError("Failed to generate a response from the stock agent.")
+
+            response_data = final_state["final_response"]
+            # The request-scoped session may already be released once streaming starts, so persist with our own
+            save_db = SessionLocal()
+            try:
+                _save_assistant_responses(save_db, chat_id, response_data)
+            finally:
+                save_db.close()
+
+            if trace:
+                trace.update(output={"response": "success", "session_id": chat_id})
+                langfuse_client.flush()
+
+            yield _sse("done", {"response": response_data, "session_id": chat_id})
+        except Exception as e:
+            logger.error("Error in chat stream endpoint: %s", e)
+            if trace:
+                trace.update(output={"error": str(e)})
+                langfuse_client.flush()
+            yield _sse("error", {"detail": str(e), "session_id": chat_id})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/chats")
-async def get_chats():
+async def get_chats(db: Session = Depends(get_db)):
     """Get all chat sessions"""
     try:
-        db = next(get_db())
         chats = get_all_chats(db)
         return {"chats": [{"id": chat.id, "title": chat.title, "created_at": chat.created_at, "updated_at": chat.updated_at} for chat in chats]}
     except Exception as e:
-        print(f"Error getting chats: {e}")
+        logger.error("Error getting chats: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/chat/{chat_id}")
-async def get_chat_messages(chat_id: int):
+async def get_chat_messages(chat_id: int, db: Session = Depends(get_db)):
     """Get all messages for a specific chat"""
     try:
-        db = next(get_db())
         messages = get_chat_history(db, chat_id)
         chat_messages = []
         for msg in messages:
@@ -421,51 +746,49 @@ async def get_chat_messages(chat_id: int):
             }
 
             # Add stock data if available
-            if msg.price:
-                try:
-                    message_data["price"] = float(msg.price)
-                except:
-                    pass
-            if msg.change_percent:
-                try:
-                    message_data["changePercent"] = float(msg.change_percent)
-                except:
-                    pass
-            if msg.monthly_data:
-                try:
-                    message_data["monthlyData"] = json.loads(msg.monthly_data)
-                except:
-                    pass
-            if msg.comparison_data:
-                try:
-                    message_data["comparisonData"] = json.loads(msg.comparison_data)
-                except:
-                    pass
+            if msg.price is not None:
+                message_data["price"] = msg.price
+            if msg.change_percent is not None:
+                message_data["changePercent"] = msg.change_percent
+            try:
+                if msg.monthly_data:
+                    message_data["monthlyData"] = _load_json(msg.monthly_data)
+                if msg.comparison_data:
+                    message_data["comparisonData"] = _load_json(msg.comparison_data)
+            except ValueError:
+                logger.warning("Skipping malformed chart data on message %s", msg.id)
 
             chat_messages.append(message_data)
 
+        # Already plain JSON types (orjson encodes datetimes natively), so skip FastAPI's jsonable_encoder
+        # walk over every chart point
+        if orjson:
+            return ORJSONResponse({"messages": chat_messages})
         return {"messages": chat_messages}
     except Exception as e:
-        print(f"Error getting chat messages: {e}")
+        logger.error("Error getting chat messages: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/chat/{chat_id}")
-async def delete_chat(chat_id: int):
+async def delete_chat(chat_id: int, db: Session = Depends(get_db)):
     """Delete a chat session"""
     try:
-        from database import Chat
-        db = next(get_db())
-        chat = db.query(Chat).filter(Chat.id == chat_id).first()
-        if chat:
-            db.delete(chat)
-            db.commit()
+        if delete_chat_session(db, chat_id):
             return {"message": "Chat deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Chat not found")
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error deleting chat: {e}")
+        logger.error("Error deleting chat: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/cache/{ticker}")
+async def clear_ticker_cache(ticker: str):
+    """Drop everything cached for a ticker so the next question about it refetches fresh data"""
+    await invalidate_stock_data(ticker)
+    return {"message": f"Cache cleared for {ticker.upper()}"}
+
 @app.get("/test-langfuse")
 async def test_langfuse():
     """
@@ -1,44 +1,235 @@
+import numpy as np
 import yfinance as yf
+from yfinance.exceptions import YFRateLimitError, YFPricesMissingError
+from curl_cffi import requests as curl_requests
 import json
 import os
-from typing import Dict, Any, List
+import re
+import asyncio
+import hashlib
+import time
+import threading
+import logging
+from collections import Counter, deque
+from dataclasses import dataclass, fields
+from typing import Dict, Any, List, Callable, Awaitable, Tuple
+from cachetools import TTLCache
+import cache as cache_store
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from datetime import datetime, timedelta
 
-def get_stock_data(ticker_symbol: str) -> Dict[str, Any] | None:
+logger = logging.getLogger("stockstalk.tools")
+
+# One browser-impersonating curl_cffi session shared by every yfinance call, so connections to Yahoo
+# (and their TLS handshakes) are reused across tickers and requests
+YF_SESSION = curl_requests.Session(impersonate="chrome")
+
+# Yahoo throttles bursts; rate-limited calls are retried with exponential backoff
+YF_MAX_RETRIES = 3
+YF_RETRY_BACKOFF = 0.3
+
+def _retry_on_rate_limit(call: Callable[[], Any]) -> Any:
+    # Runs inside worker threads, so sleeping here doesn't block the event loop
+    for attempt in range(YF_MAX_RETRIES):
+        try:
+            return call()
+        except YFRateLimitError:
+            if attempt == YF_MAX_RETRIES - 1:
+                raise
+            time.sleep(YF_RETRY_BACKOFF * 2 ** attempt)
+
+# Every blocking yfinance call runs in a worker thread; the semaphore caps how many are in flight
+# at once across all requests so bursts of tickers don't trip Yahoo's rate limiter
+YF_MAX_CONCURRENCY = int(os.getenv("YF_MAX_CONCURRENCY", "8"))
+_yf_semaphore = asyncio.Semaphore(YF_MAX_CONCURRENCY)
+
+async def _run_blocking(fn: Callable[..., Any], *args: Any) -> Any:
+    async with _yf_semaphore:
+        return await asyncio.to_thread(fn, *args)
+
+def get_company_profile(ticker_symbol: str) -> Tuple[str | None, str | None]:
+    """
+    Fetches a company's (long name, sector) with the heavy quote-summary request. Callers cache the
+    result per ticker (see _fetch_profile); failures raise and are therefore not cached.
+    """
+    info = _retry_on_rate_limit(yf.Ticker(ticker_symbol, session=YF_SESSION).get_info)
+    return info.get('longName'), info.get('sector')
+
+def _is_unknown_symbol(ticker: yf.Ticker) -> bool:
+    # fast_info also comes back empty when Yahoo is down or answers with an error page, so only a chart
+    # response carrying Yahoo's own error (e.g. "No data found, symbol may be delisted") counts as unknown
+    try:
+        ticker.history(period="5d", raise_errors=True)
+    except YFPricesMissingError as e:
+        return "Yahoo error" in e.debug_info
+    except Exception:
+        return False
+    return False
+
+def _get_quote(ticker_symbol: str) -> Dict[str, Any]:
+    # Get basic quote data; fast_info avoids downloading the full quote summary. Every field is read
+    # here so any lazy network access happens in this worker thread, not on the event loop.
+    ticker = yf.Ticker(ticker_symbol, session=YF_SESSION)
+    fast_info = ticker.fast_info
+    current_price = _retry_on_rate_limit(lambda: fast_info.last_price)
+    return {
+        "current_price": current_price,
+        "previous_close": fast_info.previous_close,
+        "volume": fast_info.last_volume or 0,
+        "market_cap": fast_info.market_cap,
+        "unknown_symbol": current_price is None and _is_unknown_symbol(ticker)
+    }
+
+def _get_profile_or_default(ticker_symbol: str) -> Tuple[str | None, str | None]:
+    try:
+        return get_company_profile(ticker_symbol.upper())
+    except Exception as e:
+        logger.warning("Error fetching profile for %s: %s", ticker_symbol, e)
+        return None, None
+
+# History and chart settings are read once at import; main loads .env before importing this module
+HISTORICAL_DATA_DAYS = int(os.getenv("HISTORICAL_DATA_DAYS", "2"))  # Configurable days for historical data
+HISTORICAL_INTERVAL = os.getenv("HISTORICAL_INTERVAL", "1h")
+CHART_DATA_DAYS = int(os.getenv("CHART_DATA_DAYS", "30"))
+CHART_INTERVAL = os.getenv("CHART_INTERVAL", "1d")
+
+# Daily chart bars can be resampled from hourly quote history, so one request serves both
+CHART_FROM_HISTORY = CHART_INTERVAL == "1d" and HISTORICAL_INTERVAL in ("1h", "60m") and CHART_DATA_DAYS < 730
+# Quote history is extended to cover the chart window when the chart is derived from it
+HISTORY_FETCH_DAYS = max(HISTORICAL_DATA_DAYS, CHART_DATA_DAYS) if CHART_FROM_HISTORY else HISTORICAL_DATA_DAYS
+
+# With CHARTS_ON_DEMAND set, a chart that needs its own Yahoo request is only fetched when the question asks for one
+CHARTS_ON_DEMAND = os.getenv("CHARTS_ON_DEMAND", "").lower() in ("1", "true", "yes")
+_CHART_QUERY_RE = re.compile(r"chart|graph|trend|week|month|year|history|historical|movement", re.IGNORECASE)
+
+def wants_chart(user_query: str) -> bool:
+    """
+    Whether a stock answer to this query should include chart data.
+    """
+    if CHART_FROM_HISTORY or not CHARTS_ON_DEMAND:
+        return True  # Charts resampled from the quote's history cost no extra request
+    return bool(_CHART_QUERY_RE.search(user_query))
+
+def _history_window() -> Tuple[datetime, datetime]:
+    end_date = datetime.now()
+    return end_date - timedelta(days=HISTORY_FETCH_DAYS), end_date
+
+def _get_history(ticker_symbol: str):
+    # Get historical data for price changes
+    start_date, end_date = _history_window()
+    ticker = yf.Ticker(ticker_symbol, session=YF_SESSION)
+    hist_data = _retry_on_rate_limit(
+        lambda: ticker.history(start=start_date, end=end_date, interval=HISTORICAL_INTERVAL)
+    )
+    return hist_data if len(hist_data) else None
+
+# Company name and sector are effectively static, so the shared cache keeps them for a week
+PROFILE_CACHE_TTL = 7 * 24 * 3600
+# Keyed by symbol so invalidating one ticker doesn't drop every other company's profile
+_profile_cache = TTLCache(maxsize=4096, ttl=PROFILE_CACHE_TTL)
+
+async def _fetch_profile(ticker_symbol: str) -> Tuple[str | None, str | None]:
+    key = ticker_symbol.upper()
+    profile = _profile_cache.get(key)
+    if profile is not None:
+        return profile
+    redis_key = f"profile:{key}"
+    cached = await cache_store.get_json(redis_key)
+    if cached is not None:
+        profile = tuple(cached)
+        _profile_cache[key] = profile
+        return profile
+    long_name, sector = await _run_blocking(_get_profile_or_default, ticker_symbol)
+    if long_name or sector:
+        _profile_cache[key] = (long_name, sector)
+        await cache_store.set_json(redis_key, [long_name, sector], PROFILE_CACHE_TTL)
+    return long_name, sector
+
+@dataclass(slots=True, frozen=True)
+class StockSnapshot:
+    """Real-time quote and 24h performance for one ticker, as returned by get_stock_data"""
+    ticker: str
+    company_name: str
+    current_price: float | None
+    previous_close: float | None
+    daily_change: float
+    daily_change_percent: float
+    price_24h_ago: float | None
+    change_24h: float
+    change_percent_24h: float
+    high_24h: float | None
+    low_24h: float | None
+    volume: int | None
+    market_cap: int | None
+    sector: str | None
+    timestamp: str
+
+    def as_dict(self) -> Dict[str, Any]:
+        """camelCase JSON form, as sent to clients and the shared cache"""
+        return {_SNAPSHOT_JSON_KEYS[f.name]: getattr(self, f.name) for f in fields(self)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StockSnapshot":
+        return cls(**{name: data.get(key) for name, key in _SNAPSHOT_JSON_KEYS.items()})
+
+_SNAPSHOT_JSON_KEYS = {
+    "ticker": "ticker",
+    "company_name": "companyName",
+    "current_price": "currentPrice",
+    "previous_close": "previousClose",
+    "daily_change": "dailyChange",
+    "daily_change_percent": "dailyChangePercent",
+    "price_24h_ago": "price24hAgo",
+    "change_24h": "change24h",
+    "change_percent_24h": "changePercent24h",
+    "high_24h": "high24h",
+    "low_24h": "low24h",
+    "volume": "volume",
+    "market_cap": "marketCap",
+    "sector": "sector",
+    "timestamp": "timestamp",
+}
+
+async def get_stock_data(ticker_symbol: str) -> StockSnapshot | None:
     """
     Fetches real-time stock data focused on current price and 24h performance.
     """
+    if _is_unavailable(ticker_symbol):
+        return None
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        
-        # Get basic info
-        info = ticker.info
-        company_name = info.get('longName', ticker_symbol.upper())
-        current_price = info.get('currentPrice', info.get('regularMarketPrice'))
-        previous_close = info.get('previousClose')
-
-        # Get 24h historical data for price changes
-        historical_days = int(os.getenv("HISTORICAL_DATA_DAYS", "2"))
-        historical_interval = os.getenv("HISTORICAL_INTERVAL", "1h")
-
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=historical_days)  # Configurable days for historical data
-
-        hist_data = ticker.history(start=start_date, end=end_date, interval=historical_interval)
-
-        # Calculate 24h change
-        if len(hist_data) >= 24:  # Ensure we have enough data points
-            # Get price 24 hours ago
-            price_24h_ago = hist_data.iloc[-24]['Close'] if len(hist_data) >= 24 else hist_data.iloc[0]['Close']
+        # The quote, profile and 24h history are independent requests, so they run concurrently
+        quote, (long_name, sector), hist_data = await asyncio.gather(
+            _run_blocking(_get_quote, ticker_symbol),
+            _fetch_profile(ticker_symbol),
+            _fetch_history(ticker_symbol)
+        )
+        current_price = quote["current_price"]
+        if current_price is None:
+            if quote["unknown_symbol"]:
+                logger.info("Yahoo doesn't know %s, skipping it for %ss", ticker_symbol, INVALID_TICKER_TTL)
+                _invalid_ticker_cache[ticker_symbol.upper()] = True
+            else:
+                logger.warning("No price for %s", ticker_symbol)
+                _failed_ticker_cache[ticker_symbol.upper()] = True
+            return None
+        previous_close = quote["previous_close"]
+        company_name = long_name or ticker_symbol.upper()
+
+        # Calculate 24h change on plain NumPy arrays rather than through pandas indexers
+        price_24h_ago = None
+        if hist_data is not None and len(hist_data) >= 24:  # Ensure we have enough data points
+            close, high, low = hist_data[['Close', 'High', 'Low']].to_numpy().T
+
+            # Get price 24 hours ago (Yahoo leaves NaN rows for bars it has no trades for)
+            price_24h_ago = float(close[-24]) if not np.isnan(close[-24]) else None
             price_change_24h = current_price - price_24h_ago if current_price and price_24h_ago else 0
             price_change_percent_24h = (price_change_24h / price_24h_ago) * 100 if price_24h_ago and price_24h_ago != 0 else 0
 
-            # Get daily high/low in last 24h
-            last_24h_data = hist_data.tail(24)
-            high_24h = last_24h_data['High'].max()
-            low_24h = last_24h_data['Low'].min()
+            # Get daily high/low in last 24h, skipping NaN bars
+            high_window, low_window = high[-24:], low[-24:]
+            high_24h = float(np.nanmax(high_window)) if not np.isnan(high_window).all() else current_price
+            low_24h = float(np.nanmin(low_window)) if not np.isnan(low_window).all() else current_price
         else:
             price_change_24h = 0
             price_change_percent_24h = 0
@@ -49,42 +240,51 @@ def get_stock_data(ticker_symbol: str) -> Dict[str, Any] | None:
         daily_change = current_price - previous_close if current_price and previous_close else 0
         daily_change_percent = (daily_change / previous_close) * 100 if previous_close and previous_close != 0 else 0
 
-        return {
-            "ticker": ticker_symbol.upper(),
-            "companyName": company_name,
-            "currentPrice": current_price,
-            "previousClose": previous_close,
-            "dailyChange": round(daily_change, 2),
-            "dailyChangePercent": round(daily_change_percent, 2),
-            "price24hAgo": round(price_24h_ago, 2) if 'price_24h_ago' in locals() else None,
-            "change24h": round(price_change_24h, 2),
-            "changePercent24h": round(price_change_percent_24h, 2),
-            "high24h": round(high_24h, 2),
-            "low24h": round(low_24h, 2),
-            "volume": info.get('volume', 0),
-            "marketCap": info.get('marketCap'),
-            "sector": info.get('sector'),
-            "timestamp": datetime.now().isoformat()
-        }
+        return StockSnapshot(
+            ticker=ticker_symbol.upper(),
+            company_name=company_name,
+            current_price=current_price,
+            previous_close=previous_close,
+            daily_change=round(daily_change, 2),
+            daily_change_percent=round(daily_change_percent, 2),
+            price_24h_ago=round(price_24h_ago, 2) if price_24h_ago is not None else None,
+            change_24h=round(price_change_24h, 2),
+            change_percent_24h=round(price_change_percent_24h, 2),
+            high_24h=round(high_24h, 2),
+            low_24h=round(low_24h, 2),
+            volume=quote["volume"],
+            market_cap=quote["market_cap"],
+            sector=sector,
+            timestamp=datetime.now().isoformat()
+        )
     
     except Exception as e:
-        print(f"Error fetching data for {ticker_symbol}: {e}")
+        logger.warning("Error fetching data for %s: %s", ticker_symbol, e)
+        _failed_ticker_cache[ticker_symbol.upper()] = True
         return None
 
-def analyze_price_movement(stock_data: Dict[str, Any]) -> str:
+# Reasoning templates for analyze_price_movement, parsed once instead of rebuilt as f-strings per call
+_PRICE_MOVEMENT_TEMPLATE = (
+    "The stock is trading {trend} today, having {direction} ${change:.2f} ({percent:.2f}%) since yesterday's close. "
+    "{move_24h}"
+    "The trading range in the last 24 hours was between ${low:.2f} and ${high:.2f}, indicating {volatility} trading conditions."
+)
+_MOVE_24H_TEMPLATE = "Over the last 24 hours, it has moved ${change:.2f} ({percent:.2f}%). "
+
+def analyze_price_movement(snapshot: StockSnapshot) -> str:
     """
     Analyzes price movement and provides reasoning about what's happening.
     """
-    if not stock_data or not stock_data.get('currentPrice'):
+    if not snapshot or not snapshot.current_price:
         return "Unable to analyze price movement due to missing data."
 
-    current_price = stock_data['currentPrice']
-    daily_change = stock_data.get('dailyChange', 0)
-    daily_change_percent = stock_data.get('dailyChangePercent', 0)
-    change_24h = stock_data.get('change24h', 0)
-    change_percent_24h = stock_data.get('changePercent24h', 0)
-    high_24h = stock_data.get('high24h', current_price)
-    low_24h = stock_data.get('low24h', current_price)
+    current_price = snapshot.current_price
+    daily_change = snapshot.daily_change
+    daily_change_percent = snapshot.daily_change_percent
+    change_24h = snapshot.change_24h
+    change_percent_24h = snapshot.change_percent_24h
+    high_24h = snapshot.high_24h if snapshot.high_24h is not None else current_price
+    low_24h = snapshot.low_24h if snapshot.low_24h is not None else current_price
 
     # Determine trend
     if daily_change > 0:
@@ -102,81 +302,368 @@ def analyze_price_movement(stock_data: Dict[str, Any]) -> str:
     volatility = "volatile" if range_24h / current_price > 0.02 else "stable"
 
     # Generate reasoning
-    reasoning = f"The stock is trading {trend} today, having {direction} ${abs(daily_change):.2f} ({abs(daily_change_percent):.2f}%) since yesterday's close. "
-
+    move_24h = ""
     if change_24h != 0:
-        reasoning += f"Over the last 24 hours, it has moved ${abs(change_24h):.2f} ({abs(change_percent_24h):.2f}%). "
+        move_24h = _MOVE_24H_TEMPLATE.format(change=abs(change_24h), percent=abs(change_percent_24h))
+
+    return _PRICE_MOVEMENT_TEMPLATE.format_map({
+        "trend": trend,
+        "direction": direction,
+        "change": abs(daily_change),
+        "percent": abs(daily_change_percent),
+        "move_24h": move_24h,
+        "low": low_24h,
+        "high": high_24h,
+        "volatility": volatility
+    })
+
+def _chart_window() -> Tuple[datetime, datetime]:
+    # Chart data covers the last CHART_DATA_DAYS (default 30) at CHART_INTERVAL
+    end_date = datetime.now()
+    return end_date - timedelta(days=CHART_DATA_DAYS), end_date
+
+def _format_chart_data(ticker_symbol: str, hist_data) -> Dict[str, Any] | None:
+    if len(hist_data) == 0:
+        return None
 
-    reasoning += f"The trading range in the last 24 hours was between ${low_24h:.2f} and ${high_24h:.2f}, indicating {volatility} trading conditions."
+    # Convert to format suitable for graphing, column-wise rather than row by row
+    chart_frame = hist_data[['Open', 'High', 'Low', 'Close']].round(2)
+    chart_frame.columns = ['open', 'high', 'low', 'close']
+    chart_frame.insert(0, 'date', hist_data.index.strftime("%Y-%m-%d"))
+    chart_frame['volume'] = hist_data['Volume'].fillna(0).astype('int64')
+    chart_data = chart_frame.to_dict(orient='records')
 
-    return reasoning
+    return {
+        "ticker": ticker_symbol,
+        "period": f"{CHART_DATA_DAYS}d",
+        "interval": CHART_INTERVAL,
+        "data": chart_data
+    }
 
 def get_monthly_stock_data(ticker_symbol: str) -> Dict[str, Any] | None:
     """
     Fetches monthly stock data for graphing (past 30 days).
     """
     try:
-        ticker = yf.Ticker(ticker_symbol)
-
-        # Get chart data days (default 30) with configurable interval
-        chart_days = int(os.getenv("CHART_DATA_DAYS", "30"))
-        chart_interval = os.getenv("CHART_INTERVAL", "1d")
-
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=chart_days)
+        ticker = yf.Ticker(ticker_symbol, session=YF_SESSION)
+        start_date, end_date = _chart_window()
 
-        hist_data = ticker.history(start=start_date, end=end_date, interval=chart_interval)
+        hist_data = _retry_on_rate_limit(
+            lambda: ticker.history(start=start_date, end=end_date, interval=CHART_INTERVAL)
+        )
+        return _format_chart_data(ticker_symbol, hist_data)
 
-        if len(hist_data) == 0:
-            return None
-
-        # Convert to format suitable for graphing
-        chart_data = []
-        for date, row in hist_data.iterrows():
-            chart_data.append({
-                "date": date.strftime("%Y-%m-%d"),
-                "open": round(row['Open'], 2),
-                "high": round(row['High'], 2),
-                "low": round(row['Low'], 2),
-                "close": round(row['Close'], 2),
-                "volume": int(row['Volume'])
-            })
-
-        return {
-            "ticker": ticker_symbol,
-            "period": f"{chart_days}d",
-            "interval": chart_interval,
-            "data": chart_data
-        }
+    except Exception as e:
+        logger.warning("Error fetching monthly data for %s: %s", ticker_symbol, e)
+        return None
 
+def _monthly_from_history(ticker_symbol: str, hist_data) -> Dict[str, Any] | None:
+    start_date, _ = _chart_window()
+    daily = hist_data.resample("1D").agg({
+        "Open": "first",
+        "High": "max",
+        "Low": "min",
+        "Close": "last",
+        "Volume": "sum"
+    }).dropna(subset=["Close"])
+    # The window matches what a daily history request would have returned
+    daily = daily[daily.index.tz_localize(None) >= start_date.replace(hour=0, minute=0, second=0, microsecond=0)]
+    return _format_chart_data(ticker_symbol, daily)
+
+YF_BATCH_SIZE = 20
+
+# yf.download keeps its results in module-global state (yfinance.shared), so two downloads running at once
+# can hang or hand each other's frames back. Every batch download takes this lock.
+_download_lock = threading.Lock()
+
+def _download_batch(ticker_symbols: List[str], start_date: datetime, end_date: datetime, interval: str) -> Dict[str, Any]:
+    """
+    Downloads history for several tickers, one yfinance request per YF_BATCH_SIZE symbols.
+    Returns a frame per upper-cased symbol; tickers with no rows are left out.
+    """
+    frames = {}
+    for i in range(0, len(ticker_symbols), YF_BATCH_SIZE):
+        batch = ticker_symbols[i:i + YF_BATCH_SIZE]
+        try:
+            with _download_lock:
+                hist_data = yf.download(
+                    batch,
+                    start=start_date,
+                    end=end_date,
+                    interval=interval,
+                    group_by="ticker",
+                    auto_adjust=True,  # Same prices as Ticker.history
+                    # Intraday downloads default to a UTC index; keep exchange-local wall-clock times like
+                    # Ticker.history so daily bars resampled from this history split at the local midnight
+                    ignore_tz=True,
+                    threads=True,
+                    progress=False,
+                    session=YF_SESSION
+                )
+        except Exception as e:
+            logger.warning("Error batch fetching history for %s: %s", ", ".join(batch), e)
+            continue
+        for ticker_symbol in batch:
+            try:
+                # Dates are aligned across tickers, so drop the rows where this one didn't trade
+                ticker_data = hist_data[ticker_symbol.upper()].dropna(subset=['Close'])
+            except KeyError:
+                continue
+            if len(ticker_data):
+                frames[ticker_symbol.upper()] = ticker_data
+    return frames
+
+def get_monthly_stock_data_batch(ticker_symbols: List[str]) -> Dict[str, Dict[str, Any] | None]:
+    """
+    Fetches monthly chart data for several tickers with a single yfinance download.
+    """
+    start_date, end_date = _chart_window()
+    frames = _download_batch(ticker_symbols, start_date, end_date, CHART_INTERVAL)
+
+    results = {}
+    for ticker_symbol in ticker_symbols:
+        ticker_data = frames.get(ticker_symbol.upper())
+        try:
+            results[ticker_symbol] = _format_chart_data(ticker_symbol, ticker_data) if ticker_data is not None else None
+        except Exception as e:
+            logger.warning("Error fetching monthly data for %s: %s", ticker_symbol, e)
+            results[ticker_symbol] = None
+    return results
+
+# In-process caches in front of yfinance (and Redis, if configured): quotes go stale within a minute,
+# monthly history barely moves
+STOCK_CACHE_TTL = int(os.getenv("STOCK_CACHE_TTL", "60"))
+MONTHLY_CACHE_TTL = int(os.getenv("MONTHLY_CACHE_TTL", "3600"))
+_stock_data_cache = TTLCache(maxsize=1024, ttl=STOCK_CACHE_TTL)
+_monthly_data_cache = TTLCache(maxsize=1024, ttl=MONTHLY_CACHE_TTL)
+# Raw price history behind both quotes and charts; DataFrames stay in-process only
+_history_cache = TTLCache(maxsize=256, ttl=STOCK_CACHE_TTL)
+# Symbols Yahoo reported as unknown; lookups for them return None without a network round trip.
+# Other failed quotes (outages, error pages) are only skipped for a few seconds.
+INVALID_TICKER_TTL = int(os.getenv("INVALID_TICKER_TTL", "300"))
+FAILED_TICKER_TTL = int(os.getenv("FAILED_TICKER_TTL", "5"))
+_invalid_ticker_cache = TTLCache(maxsize=2048, ttl=INVALID_TICKER_TTL)
+_failed_ticker_cache = TTLCache(maxsize=2048, ttl=FAILED_TICKER_TTL)
+
+def _is_unavailable(ticker_symbol: str) -> bool:
+    key = ticker_symbol.upper()
+    return key in _invalid_ticker_cache or key in _failed_ticker_cache
+
+_fetch_locks: Dict[tuple, asyncio.Lock] = {}
+
+async def _cached_fetch(
+    cache: TTLCache,
+    namespace: str,
+    fetch: Callable[[str], Awaitable[Any]],
+    ticker_symbol: str,
+    shared: bool = True,
+    encode: Callable[[Any], Any] | None = None,
+    decode: Callable[[Any], Any] | None = None
+) -> Any:
+    key = ticker_symbol.upper()
+    if key in cache:
+        logger.debug("%s cache hit for %s", namespace, key)
+        return cache[key]
+    logger.debug("%s cache miss for %s", namespace, key)
+
+    # Single-flight: concurrent misses for the same ticker wait for one upstream fetch
+    lock_key = (id(cache), key)
+    lock = _fetch_locks.setdefault(lock_key, asyncio.Lock())
+    async with lock:
+        if key in cache:
+            return cache[key]
+
+        # Second tier: the shared Redis cache, when configured (JSON-serializable results only)
+        redis_key = f"stockdata:{namespace}:{key}"
+        result = await cache_store.get_json(redis_key) if shared else None
+        if result is not None and decode:
+            result = decode(result)
+        if result is None:
+            result = await fetch(ticker_symbol)
+            if result is not None and shared:
+                await cache_store.set_json(redis_key, encode(result) if encode else result, int(cache.ttl))
+        if result is not None:
+            cache[key] = result
+    if not lock.locked():
+        _fetch_locks.pop(lock_key, None)
+    return result
+
+async def _fetch_history(ticker_symbol: str):
+    # Quotes and charts for the same ticker are requested together, so they share one history download
+    return await _cached_fetch(
+        _history_cache, "history", lambda symbol: _run_blocking(_get_history, symbol), ticker_symbol, shared=False
+    )
+
+async def _get_monthly_data(ticker_symbol: str) -> Dict[str, Any] | None:
+    if _is_unavailable(ticker_symbol):
+        return None
+    if not CHART_FROM_HISTORY:
+        return await _run_blocking(get_monthly_stock_data, ticker_symbol)
+    try:
+        hist_data = await _fetch_history(ticker_symbol)
+        return _monthly_from_history(ticker_symbol, hist_data) if hist_data is not None else None
     except Exception as e:
-        print(f"Error fetching monthly data for {ticker_symbol}: {e}")
+        logger.warning("Error fetching monthly data for %s: %s", ticker_symbol, e)
         return None
 
-async def generate_stock_response(stock_data: Dict[str, Any], user_query: str, llm: ChatGoogleGenerativeAI) -> Dict[str, Any]:
+async def fetch_stock_data(ticker_symbol: str) -> StockSnapshot | None:
     """
-    Generates a structured response about the stock with separate components for UI display.
+    Cached wrapper around get_stock_data.
     """
-    if not stock_data:
-        return {
-            "message": "I couldn't fetch the stock data. Please check the ticker symbol and try again.",
-            "price": None,
-            "changePercent": None,
-            "monthlyData": None
-        }
+    _recent_requests.append((time.monotonic(), ticker_symbol.upper()))
+    return await _cached_fetch(
+        _stock_data_cache, "quote", get_stock_data, ticker_symbol,
+        encode=StockSnapshot.as_dict, decode=StockSnapshot.from_dict
+    )
 
-    company_name = stock_data.get('companyName', stock_data['ticker'])
-    current_price = stock_data.get('currentPrice')
-    change_percent = stock_data.get('dailyChangePercent', 0)
-    reasoning = analyze_price_movement(stock_data)
+async def fetch_monthly_stock_data(ticker_symbol: str) -> Dict[str, Any] | None:
+    """
+    Cached, non-blocking wrapper around get_monthly_stock_data.
+    """
+    return await _cached_fetch(_monthly_data_cache, "monthly", _get_monthly_data, ticker_symbol)
+
+# Static system prompt, built once and shared by every stock response
+STOCK_ANALYST_SYSTEM_MESSAGE = SystemMessage(content="You are a knowledgeable stock analyst providing clear, conversational updates about stock performance. Focus on analysis and context, not raw numbers. NEVER start responses with greetings like 'Hey there!', 'Great question!', or similar phrases. Jump straight into the analysis.")
 
-    # Get monthly data for graphing
-    monthly_data = get_monthly_stock_data(stock_data['ticker'])
+def _download_history_batch(ticker_symbols: List[str]) -> Dict[str, Any]:
+    start_date, end_date = _history_window()
+    return _download_batch(ticker_symbols, start_date, end_date, HISTORICAL_INTERVAL)
+
+async def prefetch_history(ticker_symbols: List[str]) -> None:
+    """
+    Warms the history cache for several tickers with one yfinance download per 20 symbols,
+    so the per-ticker quote and chart lookups that follow skip their own history requests.
+    """
+    missing = list(dict.fromkeys(
+        symbol.upper() for symbol in ticker_symbols
+        if symbol.upper() not in _history_cache and not _is_unavailable(symbol)
+    ))
+    if len(missing) < 2:
+        return
+    frames = await _run_blocking(_download_history_batch, missing)
+    for key, frame in frames.items():
+        _history_cache[key] = frame
+
+async def invalidate_stock_data(ticker_symbol: str) -> None:
+    """
+    Drops everything cached for a ticker (quote, chart, history, company profile, stored analyses and
+    unknown-symbol marks) in-process and in Redis, so the next request refetches it all.
+    """
+    key = ticker_symbol.upper()
+    _stock_data_cache.pop(key, None)
+    _monthly_data_cache.pop(key, None)
+    _history_cache.pop(key, None)
+    _invalid_ticker_cache.pop(key, None)
+    _failed_ticker_cache.pop(key, None)
+    for cache_key in [cache_key for cache_key in _stock_response_cache if cache_key.startswith(f"llmresp:{key}:")]:
+        _stock_response_cache.pop(cache_key, None)
+    _profile_cache.pop(key, None)
+    await cache_store.delete(f"stockdata:quote:{key}", f"stockdata:monthly:{key}", f"profile:{key}")
+    await cache_store.delete_matching(f"llmresp:{key}:*")
+
+async def fetch_monthly_stock_data_batch(ticker_symbols: List[str]) -> Dict[str, Dict[str, Any] | None]:
+    """
+    Cached, non-blocking monthly data for several tickers; cache misses share one batched download.
+    """
+    results = {ticker_symbol: _monthly_data_cache.get(ticker_symbol.upper()) for ticker_symbol in ticker_symbols}
+    for ticker_symbol, data in results.items():
+        if data is None:
+            data = await cache_store.get_json(f"stockdata:monthly:{ticker_symbol.upper()}")
+            if data is not None:
+                _monthly_data_cache[ticker_symbol.upper()] = data
+                results[ticker_symbol] = data
+    missing = [
+        ticker_symbol for ticker_symbol, data in results.items()
+        if data is None and not _is_unavailable(ticker_symbol)
+    ]
+    if not missing:
+        return results
+
+    if len(missing) == 1:
+        results[missing[0]] = await fetch_monthly_stock_data(missing[0])
+        return results
+
+    fetched = await _run_blocking(get_monthly_stock_data_batch, missing)
+    for ticker_symbol, data in fetched.items():
+        if data is not None:
+            _monthly_data_cache[ticker_symbol.upper()] = data
+            await cache_store.set_json(f"stockdata:monthly:{ticker_symbol.upper()}", data, int(_monthly_data_cache.ttl))
+        results[ticker_symbol] = data
+    return results
+
+# Background refresh: the most requested tickers of the last few minutes are refetched on a timer,
+# replacing their cache entries before they expire so requests keep landing on warm data
+REFRESH_INTERVAL = int(os.getenv("REFRESH_INTERVAL", "30"))
+REFRESH_TOP_N = int(os.getenv("REFRESH_TOP_N", "10"))
+REFRESH_WINDOW = 600
+_recent_requests: deque = deque(maxlen=10000)
+
+def _popular_tickers() -> List[str]:
+    cutoff = time.monotonic() - REFRESH_WINDOW
+    while _recent_requests and _recent_requests[0][0] < cutoff:
+        _recent_requests.popleft()
+    counts = Counter(ticker_symbol for _, ticker_symbol in _recent_requests)
+    return [ticker_symbol for ticker_symbol, _ in counts.most_common(REFRESH_TOP_N)]
+
+async def refresh_popular_tickers() -> None:
+    """
+    Refetches quotes (and charts derived from the same history) for the most requested tickers.
+    """
+    tickers = [ticker_symbol for ticker_symbol in _popular_tickers() if not _is_unavailable(ticker_symbol)]
+    if not tickers:
+        return
+    for key in tickers:
+        _history_cache.pop(key, None)
+    await prefetch_history(tickers)
+    snapshots = await asyncio.gather(*(get_stock_data(ticker_symbol) for ticker_symbol in tickers))
+    for key, snapshot in zip(tickers, snapshots):
+        if snapshot is None:
+            continue
+        _stock_data_cache[key] = snapshot
+        await cache_store.set_json(f"stockdata:quote:{key}", snapshot.as_dict(), int(_stock_data_cache.ttl))
+        if CHART_FROM_HISTORY:
+            monthly_data = await _get_monthly_data(key)
+            if monthly_data is not None:
+                _monthly_data_cache[key] = monthly_data
+                await cache_store.set_json(f"stockdata:monthly:{key}", monthly_data, int(_monthly_data_cache.ttl))
+    logger.debug("refreshed %s", ", ".join(tickers))
+
+async def run_cache_refresher() -> None:
+    """Runs refresh_popular_tickers every REFRESH_INTERVAL seconds until cancelled"""
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            await refresh_popular_tickers()
+        except Exception as e:
+            logger.warning("Background cache refresh failed: %s", e)
+
+# Slow LLM calls give up after LLM_TIMEOUT seconds and use the canned fallback answer instead
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "6"))
+
+async def generate_llm_text(llm: ChatGoogleGenerativeAI, messages: list, streaming: bool = False, config: Dict[str, Any] | None = None) -> str:
+    """
+    Runs the LLM and returns its text, raising asyncio.TimeoutError after LLM_TIMEOUT seconds.
+    Whole answers are bounded; streamed ones only bound the wait for the first token, since
+    by the time a long answer runs over the client has already received part of it.
+    """
+    if not streaming:
+        response = await asyncio.wait_for(llm.ainvoke(messages, config=config), timeout=LLM_TIMEOUT)
+        return response.content
 
-    prompt = f"""
+    chunks = llm.astream(messages, config=config).__aiter__()
+    try:
+        response = await asyncio.wait_for(anext(chunks), timeout=LLM_TIMEOUT)
+    except StopAsyncIteration:
+        return ""
+    async for chunk in chunks:
+        response += chunk
+    return response.content
+
+# Per-stock prompt, parsed once and filled per request
+STOCK_PROMPT_TEMPLATE = """
     You are a helpful stock analyst. A user asked: "{user_query}"
 
-    Stock data for {company_name} ({stock_data['ticker']}):
+    Stock data for {company_name} ({ticker}):
     - Current price: ${current_price:.2f}
     - Daily change: {change_percent:.2f}%
     - Price analysis: {reasoning}
@@ -188,22 +675,87 @@ async def generate_stock_response(stock_data: Dict[str, Any], user_query: str, l
     Make it sound like a knowledgeable friend explaining the stock's current situation and market context.
     """
 
-    messages = [
-        SystemMessage(content="You are a knowledgeable stock analyst providing clear, conversational updates about stock performance. Focus on analysis and context, not raw numbers. NEVER start responses with greetings like 'Hey there!', 'Great question!', or similar phrases. Jump straight into the analysis."),
-        HumanMessage(content=prompt)
-    ]
-    
-    try:
-        response = await llm.ainvoke(messages)
-        message = response.content
-    except Exception as e:
-        print(f"Error generating response: {e}")
-        # Fallback message
-        message = f"{company_name} is showing some interesting market activity. {reasoning.split('.')[0]}. Please note this is not financial advice."
+# Generated stock analyses, keyed by ticker, price/change bucket and question
+_stock_response_cache = TTLCache(maxsize=1024, ttl=120)
+
+def _stock_response_cache_key(ticker: str, current_price: float, change_percent: float, user_query: str) -> str:
+    intent = hashlib.blake2b(user_query.strip().lower().encode("utf-8"), digest_size=8).hexdigest()
+    return f"llmresp:{ticker}:{round(current_price, 1)}:{round(change_percent, 1)}:{intent}"
+
+async def generate_stock_response(
+    stock_data: StockSnapshot | None,
+    user_query: str,
+    llm: ChatGoogleGenerativeAI,
+    monthly_data: Dict[str, Any] | None = None,
+    chart_fetched: bool = False,
+    on_meta: Callable[[Dict[str, Any]], None] | None = None,
+    streaming: bool = False
+) -> Dict[str, Any]:
+    """
+    Generates a structured response about the stock with separate components for UI display.
+    Callers that already looked up the chart pass chart_fetched=True with its result (None if it
+    failed or wasn't wanted) as monthly_data. on_meta, if given, receives the ticker, price, change
+    and chart as soon as they are known, before the analysis text is generated.
+    """
+    if not stock_data:
+        return {
+            "message": "I couldn't fetch the stock data. Please check the ticker symbol and try again.",
+            "price": None,
+            "changePercent": None,
+            "monthlyData": None
+        }
+
+    company_name = stock_data.company_name or stock_data.ticker
+    current_price = stock_data.current_price
+    change_percent = stock_data.daily_change_percent or 0
+    reasoning = analyze_price_movement(stock_data)
+
+    # Get monthly data for graphing, unless the caller fetched it alongside the quote
+    if not chart_fetched and wants_chart(user_query):
+        monthly_data = await fetch_monthly_stock_data(stock_data.ticker)
+    price = round(current_price, 2) if current_price else None
+    if on_meta:
+        on_meta({"ticker": stock_data.ticker, "price": price, "changePercent": round(change_percent, 2), "monthlyData": monthly_data})
+
+    # The analysis only changes when the price moves, so identical questions within the same price
+    # bucket reuse the previous answer
+    cache_key = _stock_response_cache_key(stock_data.ticker, current_price, change_percent, user_query)
+    message = _stock_response_cache.get(cache_key)
+    if message is None:
+        message = await cache_store.get_json(cache_key)
+        if message is not None:
+            _stock_response_cache[cache_key] = message
+
+    if message is None:
+        messages = [
+            STOCK_ANALYST_SYSTEM_MESSAGE,
+            HumanMessage(content=STOCK_PROMPT_TEMPLATE.format_map({
+                "user_query": user_query,
+                "company_name": company_name,
+                "ticker": stock_data.ticker,
+                "current_price": current_price,
+                "change_percent": change_percent,
+                "reasoning": reasoning
+            }))
+        ]
+
+        try:
+            # Tagged with the ticker so streamed tokens can be told apart when several stocks are answered at once
+            message = await generate_llm_text(llm, messages, streaming, config={"metadata": {"ticker": stock_data.ticker}})
+            # Only real answers are cached, never the fallback text below
+            _stock_response_cache[cache_key] = message
+            await cache_store.set_json(cache_key, message, int(_stock_response_cache.ttl))
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                logger.warning("LLM timed out after %ss generating the %s response", LLM_TIMEOUT, stock_data.ticker)
+            else:
+                logger.error("Error generating response: %s", e)
+            # Fallback message
+            message = f"{company_name} is showing some interesting market activity. {reasoning.split('.')[0]}. Please note this is not financial advice."
 
     return {
         "message": message,
-        "price": round(current_price, 2) if current_price else None,
+        "price": price,
         "changePercent": round(change_percent, 2),
         "monthlyData": monthly_data
     }